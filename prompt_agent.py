@@ -4,157 +4,222 @@ Prompt Generation Agent
 Automatically generates detailed prompts for character scenes and updates test.py
 """
 
+import json
+import mmap
 import re
 import random
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Dict, Any, Tuple
 from itertools import combinations
 
-class PromptAgent:
-    def __init__(self):
-        # Character themes and properties
-        self.character_themes = {
-            "Ballerina Cappuccina": {
-                "colors": ["pink", "rose gold", "white"],
-                "props": ["tutu", "ballet shoes", "tiara", "ribbons"],
-                "style": "elegant and graceful",
-                "personality": "graceful"
-            },
-            "Stick": {
-                "colors": ["brown", "wooden", "natural"],
-                "props": ["leaves", "twigs", "forest items"],
-                "style": "simple and natural",
-                "personality": "down-to-earth"
-            },
-            "Tralalelo Tralala": {
-                "colors": ["aqua-blue", "light blue", "grey"],
-                "props": ["sharks", "ocean items", "slime bucket"],
-                "style": "playful and oceanic",
-                "personality": "playful"
-            },
-            "Cappuccino Assassino": {
-                "colors": ["coffee brown", "cream", "dark espresso"],
-                "props": ["coffee cups", "steam", "cafe items"],
-                "style": "mysterious and caffeinated",
-                "personality": "mysterious"
-            },
-            "Brr Brr Patapim": {
-                "colors": ["icy blue", "white", "frost"],
-                "props": ["snowflakes", "ice crystals", "winter items"],
-                "style": "cool and refreshing",
-                "personality": "cool"
-            },
-            "Alligator": {
-                "colors": ["green", "swamp green", "muddy brown"],
-                "props": ["water plants", "logs", "swamp items"],
-                "style": "wild and reptilian",
-                "personality": "wild"
-            },
-            "Elephant": {
-                "colors": ["grey", "dusty brown", "earthy"],
-                "props": ["peanuts", "trees", "safari items"],
-                "style": "gentle and majestic",
-                "personality": "gentle"
-            },
-            "Hippo": {
-                "colors": ["purple", "lavender", "soft grey"],
-                "props": ["water lilies", "mud", "river items"],
-                "style": "chunky and lovable",
-                "personality": "lovable"
-            },
-            "Orca": {
-                "colors": ["black", "white", "icy-white"],
-                "props": ["waves", "ocean items", "fish"],
-                "style": "majestic and marine",
-                "personality": "majestic"
-            },
-            "Pigeon": {
-                "colors": ["soft-grey", "white", "blue-grey"],
-                "props": ["feathers", "city items", "breadcrumbs"],
-                "style": "urban and nimble",
-                "personality": "nimble"
-            },
-            "Espressina": {
-                "colors": ["dark brown", "coffee", "cream"],
-                "props": ["espresso cups", "steam", "coffee beans"],
-                "style": "energetic and caffeinated",
-                "personality": "energetic"
-            },
-            "Chimpanzini": {
-                "colors": ["brown", "tan", "jungle green"],
-                "props": ["bananas", "vines", "jungle items"],
-                "style": "playful and mischievous",
-                "personality": "mischievous"
-            },
-            "Gusini": {
-                "colors": ["white", "orange", "pond blue"],
-                "props": ["water drops", "pond items", "feathers"],
-                "style": "graceful and aquatic",
-                "personality": "graceful"
-            },
-            "Teepot": {
-                "colors": ["ceramic white", "steam blue", "warm brown"],
-                "props": ["tea cups", "steam", "tea leaves"],
-                "style": "warm and cozy",
-                "personality": "cozy"
-            },
-            "Tung": {
-                "colors": ["bright yellow", "energetic orange", "sunny"],
-                "props": ["musical notes", "rhythm items", "sound waves"],
-                "style": "rhythmic and energetic",
-                "personality": "rhythmic"
-            },
-            "Fish": {
-                "colors": ["ocean blue", "scale silver", "coral"],
-                "props": ["bubbles", "seaweed", "coral items"],
-                "style": "fluid and aquatic",
-                "personality": "fluid"
-            },
-            "Hamster": {
-                "colors": ["golden brown", "fluffy white", "cozy beige"],
-                "props": ["nuts", "wheel", "cozy bedding"],
-                "style": "cute and energetic",
-                "personality": "energetic"
-            },
-            "Orange": {
-                "colors": ["bright orange", "citrus yellow", "sunny"],
-                "props": ["citrus slices", "sunshine", "fresh items"],
-                "style": "bright and refreshing",
-                "personality": "cheerful"
-            }
-        }
+from jinja2 import Environment
+
+# Optional: numpy-backed bulk sampling for large fixed-size draws;
+# the random module path below stays as the fallback
+try:
+    import numpy as np
+    _RNG = np.random.default_rng()
+except ImportError:
+    np = None
+
+# Prompt templates, compiled once per process; render() is then cheap
+# and the format can grow without touching the generation code
+_TEMPLATE_ENV = Environment()
+_SINGLE_PROMPT_TPL = _TEMPLATE_ENV.from_string("{{ character }} {{ action }} in {{ location }}")
+_MULTI_PROMPT_TPL = _TEMPLATE_ENV.from_string(
+    "{% if characters|length == 2 %}{{ characters[0] }} and {{ characters[1] }}"
+    "{% else %}{{ characters[:-1]|join(', ') }}, and {{ characters[-1] }}{% endif %}"
+    " {{ action }} in {{ location }}"
+)
+
+# Precompiled patterns - compiled once at import, reused across calls
+_JOINT_PROMPTS_RE = re.compile(r'JOINT_PROMPTS\s*=\s*\[.*?\]', re.DOTALL)
+_CHAR_COUNT_RE = re.compile(r'\[(\d+)(?:-(\d+))?\](.+)')
+
+# Character themes and properties
+_CHARACTER_THEMES = {
+    "Ballerina Cappuccina": {
+        "colors": ["pink", "rose gold", "white"],
+        "props": ["tutu", "ballet shoes", "tiara", "ribbons"],
+        "style": "elegant and graceful",
+        "personality": "graceful"
+    },
+    "Stick": {
+        "colors": ["brown", "wooden", "natural"],
+        "props": ["leaves", "twigs", "forest items"],
+        "style": "simple and natural",
+        "personality": "down-to-earth"
+    },
+    "Tralalelo Tralala": {
+        "colors": ["aqua-blue", "light blue", "grey"],
+        "props": ["sharks", "ocean items", "slime bucket"],
+        "style": "playful and oceanic",
+        "personality": "playful"
+    },
+    "Cappuccino Assassino": {
+        "colors": ["coffee brown", "cream", "dark espresso"],
+        "props": ["coffee cups", "steam", "cafe items"],
+        "style": "mysterious and caffeinated",
+        "personality": "mysterious"
+    },
+    "Brr Brr Patapim": {
+        "colors": ["icy blue", "white", "frost"],
+        "props": ["snowflakes", "ice crystals", "winter items"],
+        "style": "cool and refreshing",
+        "personality": "cool"
+    },
+    "Alligator": {
+        "colors": ["green", "swamp green", "muddy brown"],
+        "props": ["water plants", "logs", "swamp items"],
+        "style": "wild and reptilian",
+        "personality": "wild"
+    },
+    "Elephant": {
+        "colors": ["grey", "dusty brown", "earthy"],
+        "props": ["peanuts", "trees", "safari items"],
+        "style": "gentle and majestic",
+        "personality": "gentle"
+    },
+    "Hippo": {
+        "colors": ["purple", "lavender", "soft grey"],
+        "props": ["water lilies", "mud", "river items"],
+        "style": "chunky and lovable",
+        "personality": "lovable"
+    },
+    "Orca": {
+        "colors": ["black", "white", "icy-white"],
+        "props": ["waves", "ocean items", "fish"],
+        "style": "majestic and marine",
+        "personality": "majestic"
+    },
+    "Pigeon": {
+        "colors": ["soft-grey", "white", "blue-grey"],
+        "props": ["feathers", "city items", "breadcrumbs"],
+        "style": "urban and nimble",
+        "personality": "nimble"
+    },
+    "Espressina": {
+        "colors": ["dark brown", "coffee", "cream"],
+        "props": ["espresso cups", "steam", "coffee beans"],
+        "style": "energetic and caffeinated",
+        "personality": "energetic"
+    },
+    "Chimpanzini": {
+        "colors": ["brown", "tan", "jungle green"],
+        "props": ["bananas", "vines", "jungle items"],
+        "style": "playful and mischievous",
+        "personality": "mischievous"
+    },
+    "Gusini": {
+        "colors": ["white", "orange", "pond blue"],
+        "props": ["water drops", "pond items", "feathers"],
+        "style": "graceful and aquatic",
+        "personality": "graceful"
+    },
+    "Teepot": {
+        "colors": ["ceramic white", "steam blue", "warm brown"],
+        "props": ["tea cups", "steam", "tea leaves"],
+        "style": "warm and cozy",
+        "personality": "cozy"
+    },
+    "Tung": {
+        "colors": ["bright yellow", "energetic orange", "sunny"],
+        "props": ["musical notes", "rhythm items", "sound waves"],
+        "style": "rhythmic and energetic",
+        "personality": "rhythmic"
+    },
+    "Fish": {
+        "colors": ["ocean blue", "scale silver", "coral"],
+        "props": ["bubbles", "seaweed", "coral items"],
+        "style": "fluid and aquatic",
+        "personality": "fluid"
+    },
+    "Hamster": {
+        "colors": ["golden brown", "fluffy white", "cozy beige"],
+        "props": ["nuts", "wheel", "cozy bedding"],
+        "style": "cute and energetic",
+        "personality": "energetic"
+    },
+    "Orange": {
+        "colors": ["bright orange", "citrus yellow", "sunny"],
+        "props": ["citrus slices", "sunshine", "fresh items"],
+        "style": "bright and refreshing",
+        "personality": "cheerful"
+    }
+}
+
+# Known locations and actions, in RANDOM-expansion order. A location or
+# action describes itself unless overridden in the template dicts below,
+# so identity entries are not repeated here.
+_LOCATION_KEYS = (
+    "bedroom",
+    "kitchen",
+    "park",
+    "forest",
+    "city",
+    "beach",
+    "classroom",
+    "garden",
+    "ocean",
+    "pool",
+    "mountain",
+)
+_ACTION_KEYS = (
+    "sleeping",
+    "playing",
+    "eating",
+    "walking",
+    "dancing",
+    "reading",
+    "painting",
+    "singing",
+    "swimming",
+    "flying",
+    "running",
+    "jumping",
+    "standing",
+)
+
+# Location templates - only non-identity descriptions
+_LOCATION_TEMPLATES = {
+    "mountain": "snowy mountain landscape"
+}
+
+# Action templates - only non-identity descriptions (currently none)
+_ACTION_TEMPLATES = {}
+
+# Rendering is memoized: with RANDOM expansion and cycling the same
+# (characters, action, location) combination recurs across prompts
+@lru_cache(maxsize=4096)
+def _render_single_prompt(character: str, action: str, location: str) -> str:
+    if character not in _CHARACTER_THEMES:
+        return f"{character} {action} in {location}"
+
+    action_desc = _ACTION_TEMPLATES.get(action, action)
+    location_desc = _LOCATION_TEMPLATES.get(location, location)
+    return _SINGLE_PROMPT_TPL.render(character=character, action=action_desc, location=location_desc)
+
+@lru_cache(maxsize=4096)
+def _render_multi_prompt(characters: Tuple[str, ...], action: str, location: str) -> str:
+    if not set(characters).issubset(_CHARACTER_THEMES):
+        return f"{' and '.join(characters)} {action} in {location}"
+
+    action_desc = _ACTION_TEMPLATES.get(action, action)
+    location_desc = _LOCATION_TEMPLATES.get(location, location)
+    return _MULTI_PROMPT_TPL.render(characters=characters, action=action_desc, location=location_desc)
 
-        # Location templates - simple, no descriptive words
-        self.location_templates = {
-            "bedroom": "bedroom",
-            "kitchen": "kitchen",
-            "park": "park",
-            "forest": "forest",
-            "city": "city",
-            "beach": "beach",
-            "classroom": "classroom",
-            "garden": "garden",
-            "ocean": "ocean",
-            "pool": "pool",
-            "mountain": "snowy mountain landscape"
-        }
+class PromptAgent:
+    # Default target and constant replacement prefix for update_test_py,
+    # built once at class definition instead of per call
+    _DEFAULT_TEST_PATH = Path("/Users/rabankolster/Desktop/genai_work/test.py")
+    _PREFIX = "JOINT_PROMPTS = "
 
-        # Action templates - simple, no adverbs
-        self.action_templates = {
-            "sleeping": "sleeping",
-            "playing": "playing",
-            "eating": "eating",
-            "walking": "walking",
-            "dancing": "dancing",
-            "reading": "reading",
-            "painting": "painting",
-            "singing": "singing",
-            "swimming": "swimming",
-            "flying": "flying",
-            "running": "running",
-            "jumping": "jumping",
-            "standing": "standing"
-        }
+    def __init__(self):
+        # Static configuration lives at module scope; instances share it
+        self.character_themes = _CHARACTER_THEMES
+        self.location_templates = _LOCATION_TEMPLATES
+        self.action_templates = _ACTION_TEMPLATES
 
     def parse_input(self, input_str: str) -> Dict[str, Any]:
         """Parse input format: count|characters|actions|locations"""
@@ -172,13 +237,13 @@ class PromptAgent:
 
         # Parse actions
         actions = [a.strip() for a in actions_str.split(',')]
-        if actions == ['RANDOM']:
-            actions = list(self.action_templates.keys())
+        if len(actions) == 1 and actions[0] == 'RANDOM':
+            actions = list(_ACTION_KEYS)
 
         # Parse locations
         locations = [l.strip() for l in locations_str.split(',')]
-        if locations == ['RANDOM']:
-            locations = list(self.location_templates.keys())
+        if len(locations) == 1 and locations[0] == 'RANDOM':
+            locations = list(_LOCATION_KEYS)
 
         return {
             'count': count,
@@ -190,7 +255,7 @@ class PromptAgent:
     def _parse_characters(self, characters_str: str) -> Dict[str, Any]:
         """Parse character distribution syntax"""
         # Check for character count specification [2] or [1-3]
-        count_match = re.match(r'\[(\d+)(?:-(\d+))?\](.+)', characters_str)
+        count_match = _CHAR_COUNT_RE.match(characters_str)
         if count_match:
             min_chars = int(count_match.group(1))
             max_chars = int(count_match.group(2)) if count_match.group(2) else min_chars
@@ -210,7 +275,7 @@ class PromptAgent:
             mode = 'separate'
 
         # Handle ALL keyword
-        if characters == ['ALL']:
+        if len(characters) == 1 and characters[0] == 'ALL':
             characters = list(self.character_themes.keys())
 
         return {
@@ -238,8 +303,11 @@ class PromptAgent:
 
         elif mode == 'separate':
             if distribution == 'count_specified':
+                if np is not None and min_chars == max_chars and count >= 4:
+                    return self._bulk_fixed_size_combinations(characters, min_chars, count)
+
                 # Generate combinations with specified character count
-                available_chars = characters[:]
+                available_chars = set(characters)
                 for _ in range(count):
                     if min_chars == max_chars:
                         char_count = min_chars
@@ -247,15 +315,13 @@ class PromptAgent:
                         char_count = random.randint(min_chars, max_chars)
 
                     if len(available_chars) < char_count:
-                        available_chars = characters[:]  # Reset if we run out
+                        available_chars = set(characters)  # Reset if we run out
 
-                    selected = random.sample(available_chars, min(char_count, len(available_chars)))
+                    selected = random.sample(tuple(available_chars), min(char_count, len(available_chars)))
                     combinations_list.append(selected)
 
                     # Remove selected characters to avoid immediate repetition
-                    for char in selected:
-                        if char in available_chars:
-                            available_chars.remove(char)
+                    available_chars.difference_update(selected)
             else:
                 # One character per scene, cycle through if needed
                 for i in range(count):
@@ -264,6 +330,26 @@ class PromptAgent:
 
         return combinations_list
 
+    def _bulk_fixed_size_combinations(self, characters: List[str], char_count: int, count: int) -> List[List[str]]:
+        """Draw fixed-size combinations in bulk with numpy.
+
+        Consecutive chunks of shuffled copies of the character list
+        reproduce the draw-then-remove behaviour of the random-module
+        path (no character repeats until the pool is exhausted) with a
+        handful of C-level permutation calls instead of count Python
+        sampling calls.
+        """
+        char_count = min(char_count, len(characters))
+        chars_arr = np.array(characters, dtype=object)
+        chunks_per_shuffle = max(len(characters) // char_count, 1)
+
+        combinations_list = []
+        while len(combinations_list) < count:
+            perm = _RNG.permutation(chars_arr)
+            for j in range(chunks_per_shuffle):
+                combinations_list.append(perm[j * char_count:(j + 1) * char_count].tolist())
+        return combinations_list[:count]
+
     def generate_prompt(self, characters: List[str], action: str, location: str) -> str:
         """Generate detailed prompt for given characters, action, and location"""
         if len(characters) == 1:
@@ -273,34 +359,12 @@ class PromptAgent:
 
     def _generate_single_character_prompt(self, character: str, action: str, location: str) -> str:
         """Generate prompt for single character"""
-        if character not in self.character_themes:
-            return f"{character} {action} in {location}"
-
-        action_desc = self.action_templates.get(action, action)
-        location_desc = self.location_templates.get(location, location)
-
-        # Simple, direct prompt
-        prompt = f"{character} {action_desc} in {location_desc}"
-        return prompt
+        return _render_single_prompt(character, action, location)
 
     def _generate_multi_character_prompt(self, characters: List[str], action: str, location: str) -> str:
         """Generate prompt for multiple characters"""
-        if not all(char in self.character_themes for char in characters):
-            char_list = " and ".join(characters)
-            return f"{char_list} {action} in {location}"
-
-        # Create character list for prompt
-        if len(characters) == 2:
-            char_phrase = f"{characters[0]} and {characters[1]}"
-        else:
-            char_phrase = ", ".join(characters[:-1]) + f", and {characters[-1]}"
-
-        action_desc = self.action_templates.get(action, action)
-        location_desc = self.location_templates.get(location, location)
-
-        # Simple, direct prompt
-        prompt = f"{char_phrase} {action_desc} in {location_desc}"
-        return prompt
+        # Tuple key makes the combination hashable for the cache
+        return _render_multi_prompt(tuple(characters), action, location)
 
     def generate_prompts_from_input(self, input_str: str) -> List[str]:
         """Generate all prompts from input string"""
@@ -332,36 +396,40 @@ class PromptAgent:
             print(f"❌ Error parsing input: {e}")
             return []
 
-    def update_test_py(self, prompts: List[str], test_file_path: str = "/Users/rabankolster/Desktop/genai_work/test.py") -> bool:
+    def update_test_py(self, prompts: List[str], test_file_path: Path = _DEFAULT_TEST_PATH) -> bool:
         """Update the JOINT_PROMPTS in test.py with generated prompts"""
-        test_path = Path(test_file_path)
+        test_path = test_file_path if isinstance(test_file_path, Path) else Path(test_file_path)
 
         if not test_path.exists():
             print(f"❌ {test_file_path} not found")
             return False
 
         try:
-            # Read current content
-            content = test_path.read_text()
-
-            # Create new prompts section
-            prompts_str = '[\n'
-            for i, prompt in enumerate(prompts):
-                # Escape quotes in prompt
-                escaped_prompt = prompt.replace('"', '\\"')
-                prompts_str += f'    "{escaped_prompt}"'
-                if i < len(prompts) - 1:
-                    prompts_str += ','
-                prompts_str += '\n'
-            prompts_str += '    ]'
+            # Create new prompts section; json handles all escaping
+            # (quotes, backslashes, newlines) in one C-level call
+            prompts_str = json.dumps(prompts, indent=4, ensure_ascii=False)
 
             # Replace JOINT_PROMPTS section
-            pattern = r'JOINT_PROMPTS = \[.*?\]'
-            replacement = f'JOINT_PROMPTS = {prompts_str}'
-
-            new_content = re.sub(pattern, replacement, content, flags=re.DOTALL)
-
-            # Write back to file
+            replacement = self._PREFIX + prompts_str
+
+            # Fast path: when the new section is exactly the size of the
+            # old one, patch the bytes in place instead of rewriting the
+            # whole file
+            new_block = replacement.encode()
+            with open(test_path, 'r+b') as f, mmap.mmap(f.fileno(), 0) as mm:
+                start = mm.find(b'JOINT_PROMPTS')
+                end = mm.find(b']', start) if start != -1 else -1
+                if end != -1 and end + 1 - start == len(new_block):
+                    mm[start:end + 1] = new_block
+                    mm.flush()
+                    print(f"✅ Updated {test_file_path} with {len(prompts)} prompts")
+                    return True
+
+            # Section size changed (or marker missing): full rewrite
+            content = test_path.read_text()
+            # Lambda keeps json's backslash escapes out of re's
+            # replacement-template parsing
+            new_content = _JOINT_PROMPTS_RE.sub(lambda m: replacement, content)
             test_path.write_text(new_content)
             print(f"✅ Updated {test_file_path} with {len(prompts)} prompts")
             return True
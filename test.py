@@ -2,7 +2,10 @@
 # pip install google-genai pillow python-dotenv
 
 import os
+import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from pathlib import Path
 from datetime import datetime
@@ -29,6 +32,21 @@ OUT_DIR.mkdir(exist_ok=True)
 UPLOAD_DELAY = 3.0      # seconds between file uploads (increased)
 REQUEST_DELAY = 10.0    # seconds between API requests (increased)
 MAX_RETRIES = 5         # max retries for failed requests (increased)
+MAX_UPLOAD_WORKERS = 4  # concurrent reference uploads
+
+# Global upload throttle: spaces upload starts UPLOAD_DELAY apart even
+# when uploads run concurrently, so the rate limit holds across threads
+_upload_lock = threading.Lock()
+_next_upload_time = 0.0
+
+def _throttle_upload():
+    global _next_upload_time
+    with _upload_lock:
+        now = time.monotonic()
+        wait = _next_upload_time - now
+        _next_upload_time = max(now, _next_upload_time) + UPLOAD_DELAY
+    if wait > 0:
+        time.sleep(wait)
 
 # Character to reference file mapping
 CHARACTER_REFS = {
@@ -53,6 +71,32 @@ CHARACTER_REFS = {
 
 }
 
+# Reference files that actually exist on disk, resolved once at startup
+# so the upload path never has to stat() the filesystem per call. Values
+# are strings, ready to hand to the upload SDK without per-call Path
+# construction or conversion.
+_AVAILABLE_REFS = {name: str(REF_DIR / fn) for name, fn in CHARACTER_REFS.items() if (REF_DIR / fn).is_file()}
+
+# Optional: Aho-Corasick automaton for one-pass character matching.
+# Built once at import; falls back to per-character scanning if the
+# pyahocorasick package is not installed.
+try:
+    import ahocorasick
+    _CHAR_AUTOMATON = ahocorasick.Automaton()
+    for _name in CHARACTER_REFS:
+        _CHAR_AUTOMATON.add_word(_name, _name)
+    _CHAR_AUTOMATON.make_automaton()
+except ImportError:
+    _CHAR_AUTOMATON = None
+
+# Fallback: one alternation regex over all character names (longest
+# first, so longer names win over any shorter prefix of them).
+_CHAR_RE = re.compile('|'.join(re.escape(name) for name in sorted(CHARACTER_REFS, key=len, reverse=True)))
+
+# Keywords meaning "use every character"; word boundaries keep words
+# like "installed" or "ballroom" from matching
+_ALL_KW_RE = re.compile(r'\b(?:all|five|everyone|together)\b', re.IGNORECASE)
+
 # Prompts describing scenes with ALL characters
 JOINT_PROMPTS = [
     "Orca standing in snowy mountain landscape",
@@ -74,7 +118,9 @@ def save_inline_image(part, stem="image") -> Path | None:
     mime = getattr(inline, "mime_type", "image/png")
     ext = {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp"}.get(mime, "png")
 
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    # Nanosecond suffix keeps names unique when two images arrive within
+    # the same second (strftime alone would silently overwrite)
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S_") + f"{time.time_ns() % 1_000_000:06d}"
     out_path = OUT_DIR / f"{stem}_{ts}.{ext}"
 
     raw_bytes = ensure_bytes(inline.data)
@@ -82,6 +128,13 @@ def save_inline_image(part, stem="image") -> Path | None:
         print("⚠️ Inline data empty; skipping save.")
         return None
 
+    if mime in ("image/png", "image/jpeg", "image/webp"):
+        # Bytes already match the saved extension; write them as-is
+        # instead of a full PIL decode + re-encode round trip
+        out_path.write_bytes(raw_bytes)
+        return out_path
+
+    # Unknown mime: let PIL decode and convert to PNG
     try:
         img = Image.open(BytesIO(raw_bytes))
         img.save(out_path)
@@ -98,19 +151,18 @@ def upload_ref_for_character(client, character_name):
         print(f"❌ Unknown character: {character_name}")
         return None
 
-    filename = CHARACTER_REFS[character_name]
-    p = REF_DIR / filename
-    if not p.exists():
-        print(f"❌ Missing reference file: {p}")
+    ref_path = _AVAILABLE_REFS.get(character_name)
+    if ref_path is None:
+        print(f"❌ Missing reference file: {REF_DIR / CHARACTER_REFS[character_name]}")
         return None
 
     print(f"⏳ Uploading {character_name}... (throttled)")
-    time.sleep(UPLOAD_DELAY)  # Throttle uploads
+    _throttle_upload()
 
     for attempt in range(MAX_RETRIES):
         try:
-            up = client.files.upload(file=str(p))
-            print(f"↑ Uploaded ref for {character_name}: {p.name}")
+            up = client.files.upload(file=ref_path)
+            print(f"↑ Uploaded ref for {character_name}: {CHARACTER_REFS[character_name]}")
             return up
         except Exception as e:
             print(f"⚠️ Upload attempt {attempt + 1} failed for {character_name}: {e}")
@@ -124,30 +176,48 @@ def upload_ref_for_character(client, character_name):
 
 def extract_characters_from_prompt(prompt):
     """Extract character names from prompt text"""
-    found_characters = []
-    for character in CHARACTER_REFS.keys():
-        if character in prompt:
-            found_characters.append(character)
+    if _CHAR_AUTOMATON is not None:
+        # Single linear sweep over the prompt for all character names
+        found_characters = list(dict.fromkeys(v for _, v in _CHAR_AUTOMATON.iter(prompt)))
+    else:
+        # One regex pass replaces a substring search per character;
+        # dict.fromkeys dedupes while preserving match order
+        found_characters = list(dict.fromkeys(_CHAR_RE.findall(prompt)))
 
     # Check for "all" keywords
-    if any(word in prompt.lower() for word in ["all", "five", "everyone", "together"]):
+    if _ALL_KW_RE.search(prompt):
         return list(CHARACTER_REFS.keys())
 
     return found_characters
 
-def upload_refs_for_characters(client, character_names):
-    """Upload reference images for multiple characters"""
-    uploaded = []
+def upload_refs_for_characters(client, character_names, ref_cache=None):
+    """Upload reference images for multiple characters.
+
+    ref_cache maps character name -> uploaded file handle (or None for a
+    failed upload); cached characters are reused without re-uploading.
+    """
+    if ref_cache is None:
+        ref_cache = {}
+    to_upload = [c for c in dict.fromkeys(character_names) if c not in ref_cache]
+    if to_upload:
+        # Uploads are network-bound; run them concurrently, throttled
+        # globally by _throttle_upload
+        with ThreadPoolExecutor(max_workers=MAX_UPLOAD_WORKERS) as pool:
+            uploads = pool.map(lambda c: upload_ref_for_character(client, c), to_upload)
+            ref_cache.update(zip(to_upload, uploads))
     for character in character_names:
-        ref_file = upload_ref_for_character(client, character)
-        if ref_file:
-            uploaded.append(ref_file)
-    return uploaded
+        if character not in to_upload:
+            print(f"♻️ Reusing uploaded ref for {character}")
+    return [ref_cache[c] for c in character_names if ref_cache[c]]
 
 # ===== Main =====
 def main():
     client = genai.Client(api_key=api_key)
 
+    # Uploaded references, shared across prompts so each character is
+    # uploaded at most once per run
+    ref_cache = {}
+
     # Generate per prompt
     for idx, prompt in enumerate(JOINT_PROMPTS, start=1):
         print(f"\n→ Generating for prompt #{idx}: {prompt[:80]}{'...' if len(prompt)>80 else ''}")
@@ -161,7 +231,7 @@ def main():
             continue
 
         print(f"[#{idx}] Uploading references for: {', '.join(characters)}")
-        ref_files = upload_refs_for_characters(client, characters)
+        ref_files = upload_refs_for_characters(client, characters, ref_cache)
         if not ref_files:
             print(f"[#{idx}] Failed to upload any references")
             continue